@@ -0,0 +1,188 @@
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import requests
+import urllib3
+
+WARM_BYTES = 1024 * 1024
+
+
+class Scene:
+    def __init__(self, at, sections, clear=True, play_videos=False, play_audio=False, name=""):
+        # type: (float, List[Dict], bool, bool, bool, str) -> None
+        # each section is a dict with w, h, x, y and app_type, plus the content to show: either a "url"
+        # (or a local "file" to share through the asset server) passed to set_url, or a "method" with "args"/"kwargs",
+        # e.g. {"method": "set_position", "kwargs": {"latitude": 0, "longitude": 0}} for a map
+        self.at = at
+        self.sections = sections
+        self.clear = clear
+        self.play_videos = play_videos
+        self.play_audio = play_audio
+        self.name = name
+
+
+class CueScheduler:
+    def __init__(self, space, scenes, server=None, prefetch_lead=10.0, compensate_latency=True, max_workers=4):
+        # type: (object, List[Scene], object, float, bool, int) -> None
+        self.space = space
+        self.server = server
+        self.scenes = sorted(scenes, key=lambda scene: scene.at)
+        self.prefetch_lead = prefetch_lead
+        self.compensate_latency = compensate_latency
+        self.max_workers = max_workers
+
+        self.executor = None
+        self.session = None
+
+        self.prepared = False
+        self.stopped = threading.Event()
+        self.latency_estimate = 0.0
+        self.report = []  # type: List[Dict]
+
+    def prepare(self):
+        # resolve everything that does not depend on the cue time, so that problems surface before the show starts;
+        # the scenes are copied so the caller's section dicts are left untouched
+        prepared = []
+        for scene in self.scenes:
+            scene = copy.copy(scene)
+            scene.sections = [dict(spec) for spec in scene.sections]
+            prepared.append(scene)
+
+            for spec in scene.sections:
+                if spec["app_type"] not in self.space.apps:
+                    raise ValueError("%s is not a valid app type (scene %s)" % (spec["app_type"], scene.name))
+                if not self.space.fits(spec["w"], spec["h"], spec["x"], spec["y"]):
+                    raise ValueError("Section in scene %s would extend beyond space" % scene.name)
+
+                if "file" in spec and "url" not in spec:
+                    if self.server is None:
+                        raise ValueError("A server is required to share %s" % spec["file"])
+                    if spec["app_type"] == "images":
+                        spec["url"] = self.server.share_image(spec["file"])
+                    else:
+                        spec["url"] = self.server.share_file(spec["file"])
+
+                if "method" not in spec:
+                    spec["method"] = "set_url"
+                    spec["args"] = [spec.get("url", "")]
+
+        self.scenes = prepared
+        self.prepared = True
+
+    def prefetch(self, scene):
+        for spec in scene.sections:
+            # content can also be passed to the section's method, e.g. set_data(json_url=...)
+            urls = find_urls([spec.get("url", ""), spec.get("args", []), spec.get("kwargs", {})])
+            for url in sorted(set(urls)):
+                self.executor.submit(self.__warm__, url)
+
+    def __warm__(self, url):
+        # only the first megabyte is requested: this resolves the host, opens a keep-alive connection, checks the
+        # asset exists and primes any upstream cache with its head, without downloading whole videos to this machine
+        try:
+            with self.session.get(url, headers={"Range": "bytes=0-%d" % (WARM_BYTES - 1)}, stream=True,
+                                  timeout=30) as r:
+                r.raise_for_status()
+                r.raw.read(WARM_BYTES)
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+            print("Prefetch of %s failed:" % url, e)
+
+    def fire(self, scene):
+        if scene.clear:
+            self.space.delete_sections()
+
+        for spec in scene.sections:
+            section = self.space.add_section(spec["w"], spec["h"], spec["x"], spec["y"], spec["app_type"])
+            if section:
+                getattr(section, spec["method"])(*spec.get("args", []), **spec.get("kwargs", {}))
+
+        if scene.play_videos:
+            self.space.videos.play()
+        if scene.play_audio:
+            self.space.audio.play()
+
+    def run(self):
+        if not self.prepared:
+            self.prepare()
+
+        self.stopped.clear()
+        self.report = []
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.session = requests.Session()
+        try:
+            return self.__run__()
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.session.close()
+
+    def __run__(self):
+        start = time.monotonic()
+
+        prefetched = set()
+        for i, scene in enumerate(self.scenes):
+            # warm the assets of each scene prefetch_lead seconds ahead of its cue, including any later scene
+            # whose prefetch window opens before this cue fires
+            for j in range(i, len(self.scenes)):
+                if j not in prefetched and self.scenes[j].at - self.prefetch_lead <= scene.at:
+                    if not self.__wait_until__(start + self.scenes[j].at - self.prefetch_lead):
+                        return self.report
+                    self.prefetch(self.scenes[j])
+                    prefetched.add(j)
+
+            lead = self.latency_estimate if self.compensate_latency else 0.0
+            if not self.__wait_until__(start + scene.at - lead):
+                break
+
+            fired = time.monotonic()
+            self.fire(scene)
+            done = time.monotonic()
+
+            latency = done - fired
+            self.latency_estimate = latency if i == 0 else 0.7 * self.latency_estimate + 0.3 * latency
+
+            self.report.append({
+                "scene": scene.name,
+                "scheduled": scene.at,
+                "fired": fired - start,
+                "completed": done - start,
+                "jitter": done - start - scene.at
+            })
+
+        return self.report
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopped.set()
+
+    def __wait_until__(self, target):
+        # sleep coarsely, then spin for the last couple of milliseconds to avoid oversleeping
+        while True:
+            remaining = target - time.monotonic()
+            if remaining <= 0:
+                return not self.stopped.is_set()
+            if remaining > 0.002:
+                if self.stopped.wait(remaining - 0.002):
+                    return False
+
+    def summary(self):
+        jitters = [abs(entry["jitter"]) for entry in self.report]
+        if not jitters:
+            return {"cues": 0, "mean_jitter": 0.0, "max_jitter": 0.0}
+        return {"cues": len(jitters), "mean_jitter": sum(jitters) / len(jitters), "max_jitter": max(jitters)}
+
+
+def find_urls(value):
+    if isinstance(value, str):
+        return [value] if value.startswith("http") else []
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [url for item in value for url in find_urls(item)]
+    return []
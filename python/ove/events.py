@@ -0,0 +1,254 @@
+import asyncio
+import copy
+import json
+import queue
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+
+class EventBus:
+    def __init__(self, space, reconnect_delay=1.0, max_queue_size=1000):
+        # type: (object, float, int) -> None
+        self.space = space
+        self.reconnect_delay = reconnect_delay
+
+        ws_host = space.ove_host.replace("http", "ws", 1)
+        self.ws_url = "%s:%s/" % (ws_host, space.control_port)
+
+        # only sections whose full state has been seeded from the REST API are mirrored, and the mirror is
+        # dropped whenever the connection is lost, as any broadcasts missed while disconnected would make it stale
+        self.states = {}  # type: Dict[str, Dict]
+        # sections whose REST state is being fetched, flagged True if a broadcast arrived in the meantime, in which
+        # case the fetched state may already be out of date and is not mirrored
+        self.pending = {}  # type: Dict[str, bool]
+        self.lock = threading.Lock()
+
+        self.state_callbacks = []
+        self.playback_callbacks = []
+        self.section_callbacks = []
+
+        self.subscribers = []
+        self.max_queue_size = max_queue_size
+
+        self.ws = None
+        self.running = False
+        self.connected = threading.Event()
+
+    def start(self):
+        if websocket is None:
+            raise ImportError("The websocket-client package is required to subscribe to OVE events")
+        if self.running:
+            return
+
+        self.running = True
+        thread = threading.Thread(target=self.__run__, daemon=True)
+        thread.start()
+
+    def __run__(self):
+        while self.running:
+            self.ws = websocket.WebSocketApp(self.ws_url, on_open=self.__on_open__,
+                                             on_message=self.__on_message__, on_close=self.__on_close__)
+            self.ws.run_forever()
+            self.__disconnected__()
+            if self.running:
+                print("Lost connection to %s, reconnecting in %ss" % (self.ws_url, self.reconnect_delay))
+                time.sleep(self.reconnect_delay)
+
+    def __on_open__(self, ws):
+        self.connected.set()
+
+    def __on_close__(self, ws, *args):
+        self.__disconnected__()
+
+    def __disconnected__(self):
+        self.connected.clear()
+        with self.lock:
+            self.states = {}
+            self.pending = {}
+
+    def __on_message__(self, ws, raw):
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return
+        self.dispatch(data)
+
+    def stop(self):
+        self.running = False
+        self.__disconnected__()
+        for offer in list(self.subscribers):
+            offer(None)
+        if self.ws:
+            self.ws.close(timeout=1)
+
+    def wait_until_connected(self, timeout=None):
+        return self.connected.wait(timeout)
+
+    def dispatch(self, data):
+        # type: (Dict) -> Optional[Dict]
+        if not isinstance(data, dict) or not isinstance(data.get("message"), dict):
+            return None
+
+        app_id = data.get("appId", "")
+        message = data["message"]
+
+        if app_id == "core":
+            section_id = message.get("id")
+            if section_id is not None:
+                section_id = str(section_id)
+            if message.get("action") == "delete":
+                if section_id is None:
+                    self.invalidate_all()
+                else:
+                    self.invalidate(section_id)
+            event = {"type": "section", "app": app_id, "section_id": section_id, "data": message}
+            callbacks = self.section_callbacks
+
+        elif "operation" in message:
+            section_id = str(data["sectionId"]) if "sectionId" in data else None
+            event = {"type": "playback", "app": app_id, "section_id": section_id, "data": message["operation"]}
+            callbacks = self.playback_callbacks
+
+        elif "sectionId" in data:
+            section_id = str(data["sectionId"])
+            # apps broadcast partial updates, so they are merged into the seeded state rather than replacing it
+            with self.lock:
+                if section_id in self.states:
+                    self.states[section_id].update(copy.deepcopy(message))
+                elif section_id in self.pending:
+                    self.pending[section_id] = True
+            event = {"type": "state", "app": app_id, "section_id": section_id, "data": message}
+            callbacks = self.state_callbacks
+
+        else:
+            return None
+
+        for callback in list(callbacks):
+            try:
+                callback(event)
+            except Exception as e:
+                print("Event callback failed:", e)
+
+        for offer in list(self.subscribers):
+            offer(event)
+
+        return event
+
+    @staticmethod
+    def __offer__(q, event):
+        # slow consumers lose the oldest events rather than blocking the connection (or stop())
+        while True:
+            try:
+                q.put_nowait(event)
+                return
+            except (queue.Full, asyncio.QueueFull):
+                try:
+                    q.get_nowait()
+                except (queue.Empty, asyncio.QueueEmpty):
+                    pass
+
+    def on_state_change(self, callback):
+        # type: (Callable[[Dict], None]) -> Callable[[], None]
+        return self.__add_callback__(self.state_callbacks, callback)
+
+    def on_playback(self, callback):
+        # type: (Callable[[Dict], None]) -> Callable[[], None]
+        return self.__add_callback__(self.playback_callbacks, callback)
+
+    def on_section_change(self, callback):
+        # type: (Callable[[Dict], None]) -> Callable[[], None]
+        return self.__add_callback__(self.section_callbacks, callback)
+
+    @staticmethod
+    def __add_callback__(callbacks, callback):
+        callbacks.append(callback)
+
+        def unsubscribe():
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+        return unsubscribe
+
+    def get_state(self, section_id):
+        # type: (str) -> Optional[Dict]
+        if not self.connected.is_set():
+            return None
+        with self.lock:
+            state = self.states.get(str(section_id))
+            return copy.deepcopy(state) if state is not None else None
+
+    def expect_seed(self, section_id):
+        # type: (str) -> None
+        # called before fetching the state over REST, so broadcasts that race with the request are noticed
+        if self.connected.is_set():
+            with self.lock:
+                self.pending.setdefault(str(section_id), False)
+
+    def seed(self, section_id, state):
+        # type: (str, Optional[Dict]) -> None
+        # state is None if the REST request failed
+        with self.lock:
+            changed = self.pending.pop(str(section_id), None)
+            # not expected (or dropped by a disconnect), or a broadcast may have superseded the fetched state
+            if state is None or changed is None or changed or not self.connected.is_set():
+                return
+            self.states[str(section_id)] = copy.deepcopy(state)
+
+    def invalidate(self, section_id):
+        # type: (str) -> None
+        with self.lock:
+            self.states.pop(str(section_id), None)
+            if str(section_id) in self.pending:
+                self.pending[str(section_id)] = True
+
+    def invalidate_all(self):
+        with self.lock:
+            self.states = {}
+            for section_id in self.pending:
+                self.pending[section_id] = True
+
+    def events(self, timeout=None):
+        q = queue.Queue(maxsize=self.max_queue_size)
+
+        def offer(event):
+            self.__offer__(q, event)
+
+        self.subscribers.append(offer)
+        try:
+            while True:
+                try:
+                    event = q.get(timeout=timeout)
+                except queue.Empty:
+                    return
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.subscribers.remove(offer)
+
+    async def async_events(self):
+        q = asyncio.Queue(maxsize=self.max_queue_size)
+        loop = asyncio.get_running_loop()
+
+        def offer(event):
+            try:
+                loop.call_soon_threadsafe(self.__offer__, q, event)
+            except RuntimeError:
+                # the event loop has been closed
+                pass
+
+        self.subscribers.append(offer)
+        try:
+            while True:
+                event = await q.get()
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.subscribers.remove(offer)
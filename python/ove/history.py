@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from six import string_types
+
+
+class LayoutHistory:
+    def __init__(self, path="./layout_history"):
+        # type: (str) -> None
+        # each version is a small manifest listing the hashes of its sections, and each distinct section state is
+        # stored once under objects/, so a version only adds the sections that changed since any earlier version
+        if path.startswith('./'):
+            path = os.path.join(os.getcwd(), path)
+        self.path = path
+        self.objects_dir = os.path.join(path, "objects")
+        self.versions_dir = os.path.join(path, "versions")
+
+        for directory in (self.objects_dir, self.versions_dir):
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+        # sections are cached in their serialised form, so callers always get fresh objects they can modify
+        self.objects = {}  # type: Dict[str, str]
+        self.manifests = {}  # type: Dict[int, Dict]
+
+    def commit(self, json_state, message=""):
+        # type: (object, str) -> int
+        state = json.loads(json_state) if isinstance(json_state, string_types) else json_state
+
+        hashes = [self.store_object(section) for section in state.get("Sections", [])]
+        attribution = state.get("Attribution", {})
+
+        latest = self.latest()
+        if latest is not None:
+            manifest = self.get_manifest(latest)
+            if manifest["sections"] == hashes and manifest["attribution"] == attribution:
+                return latest
+
+        version = 0 if latest is None else latest + 1
+        manifest = {
+            "version": version,
+            "parent": latest,
+            "timestamp": time.time(),
+            "message": message,
+            "attribution": attribution,
+            "sections": hashes
+        }
+        self.write_atomic(os.path.join(self.versions_dir, "%d.json" % version), json.dumps(manifest))
+        self.manifests[version] = manifest
+        return version
+
+    def checkout(self, version=None):
+        # type: (Optional[int]) -> str
+        # returns a state string that can be passed to Space.load_json
+        if version is None:
+            version = self.latest()
+            if version is None:
+                raise ValueError("The layout history is empty")
+
+        manifest = self.get_manifest(version)
+        return '{"Attribution": %s, "Sections": [%s]}' % (
+            json.dumps(manifest["attribution"]), ", ".join(self.load_object(h) for h in manifest["sections"]))
+
+    def diff(self, old_version, new_version):
+        # type: (int, int) -> Dict
+        # identical sections are matched by content hash without being loaded; the remaining ones are paired up as
+        # "changed" when they occupy the same geometry (or, failing that, the same position in the list), and any
+        # left over are reported as added or removed
+        old = self.get_manifest(old_version)["sections"]
+        new = self.get_manifest(new_version)["sections"]
+
+        common = Counter(old) & Counter(new)
+        old_left = unmatched(old, common)
+        new_left = unmatched(new, common)
+
+        # the sections present in both versions are in a different order
+        reordered = ([h for i, h in enumerate(old) if i not in old_left] !=
+                     [h for i, h in enumerate(new) if i not in new_left])
+
+        old_sections = {i: json.loads(self.load_object(old[i])) for i in old_left}
+        new_sections = {i: json.loads(self.load_object(new[i])) for i in new_left}
+
+        pairs = []
+        for new_index in new_left:
+            geometry = section_geometry(new_sections[new_index])
+            for old_index in old_left:
+                if section_geometry(old_sections[old_index]) == geometry:
+                    pairs.append((old_index, new_index))
+                    old_left.remove(old_index)
+                    break
+        paired = set(new_index for _, new_index in pairs)
+        new_left = [i for i in new_left if i not in paired]
+        for new_index in list(new_left):
+            if new_index in old_left:
+                pairs.append((new_index, new_index))
+                old_left.remove(new_index)
+                new_left.remove(new_index)
+
+        return {
+            "added": [new_sections[i] for i in new_left],
+            "removed": [old_sections[i] for i in old_left],
+            "changed": [{"old_index": old_index, "new_index": new_index,
+                         "old": old_sections[old_index], "new": new_sections[new_index]}
+                        for old_index, new_index in sorted(pairs, key=lambda pair: pair[1])],
+            "unchanged": sum(common.values()),
+            "reordered": reordered
+        }
+
+    def versions(self):
+        # type: () -> List[Dict]
+        return [{key: manifest[key] for key in ("version", "parent", "timestamp", "message")}
+                for manifest in (self.get_manifest(v) for v in self.version_numbers())]
+
+    def latest(self):
+        # type: () -> Optional[int]
+        numbers = self.version_numbers()
+        return numbers[-1] if numbers else None
+
+    def version_numbers(self):
+        return sorted(int(f[:-len(".json")]) for f in os.listdir(self.versions_dir) if f.endswith(".json"))
+
+    def get_manifest(self, version):
+        if version not in self.manifests:
+            path = os.path.join(self.versions_dir, "%d.json" % version)
+            if not os.path.exists(path):
+                raise ValueError("Version %s does not exist" % version)
+            with open(path, mode="r") as fin:
+                self.manifests[version] = json.loads(fin.read())
+        return self.manifests[version]
+
+    def store_object(self, section):
+        data = json.dumps(section, sort_keys=True, separators=(",", ":"))
+        h = hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+        if h not in self.objects:
+            path = self.object_path(h)
+            if not os.path.exists(path):
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                self.write_atomic(path, data)
+            self.objects[h] = data
+        return h
+
+    def load_object(self, h):
+        if h not in self.objects:
+            with open(self.object_path(h), mode="r") as fin:
+                self.objects[h] = fin.read()
+        return self.objects[h]
+
+    def object_path(self, h):
+        return os.path.join(self.objects_dir, h[:2], h[2:] + ".json")
+
+    @staticmethod
+    def write_atomic(path, data):
+        tmp_path = path + ".part"
+        with open(tmp_path, mode="w") as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+
+
+def unmatched(hashes, common):
+    # indices of the sections that are not accounted for by the sections common to both versions
+    remaining = Counter(common)
+    left = []
+    for i, h in enumerate(hashes):
+        if remaining[h] > 0:
+            remaining[h] -= 1
+        else:
+            left.append(i)
+    return left
+
+
+def section_geometry(section):
+    return tuple(section.get(key) for key in ("x", "y", "w", "h"))
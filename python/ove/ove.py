@@ -6,6 +6,8 @@ import webbrowser
 import math
 import uuid
 
+from ove.events import EventBus
+
 
 class Space:
     def __init__(self, ove_host, space_name, control_port=8080, geometry=None, offline=True, open_browsers=False):
@@ -24,6 +26,7 @@ class Space:
 
         self.videos = Videos(self)
         self.audio = Audio(self)
+        self.events = None
 
         self.row_height = 0
         self.col_width = 0
@@ -48,6 +51,17 @@ class Space:
     def disable_browser_opening(self):
         self.client.open_browsers = False
 
+    def subscribe(self, reconnect_delay=1.0):
+        if self.events is None:
+            self.events = EventBus(self, reconnect_delay=reconnect_delay)
+        self.events.start()
+        return self.events
+
+    def unsubscribe(self):
+        if self.events is not None:
+            self.events.stop()
+            self.events = None
+
     def get_geometry(self):
         r = requests.get('%s:%s/spaces' % (self.ove_host, self.control_port))
         spaces = json.loads(r.text)
@@ -97,13 +111,9 @@ class Space:
                 "y": y,
                 "app": {"url": "%s:%s/app/%s/" % (self.ove_host, self.control_port, app_type)}}
 
-        if not allow_oversized_section:
-            if (x + w) > self.geometry["width"]:
-                print("Section not created: would extend beyond space")
-                return False
-            if (y + h) > self.geometry["height"]:
-                print("Section not created: would extend beyond space")
-                return False
+        if not allow_oversized_section and not self.fits(w, h, x, y):
+            print("Section not created: would extend beyond space")
+            return False
 
         r = self.client.post("%s:%s/section" % (self.ove_host, self.control_port), params=data)
         section_id = json.loads(r.text)["id"] if not self.client.offline else str(uuid.uuid4())
@@ -140,6 +150,9 @@ class Space:
         self.sections.append(section)
         return section
 
+    def fits(self, w, h, x, y):
+        return (x + w) <= self.geometry["width"] and (y + h) <= self.geometry["height"]
+
     def to_json(self, title):
         return json.dumps({
             "Attribution": {"Title": title},
@@ -158,8 +171,12 @@ class Space:
             state = section_data["app"]["states"]["load"]
 
             if app_type == "maps":
+                tile_urls = [layer.get("source", {}).get("config", {}).get("url", "")
+                             for layer in state.get("layers", [])
+                             if layer.get("source", {}).get("type") == "ol.source.XYZ"]
+                tile_url = tile_urls[0] if tile_urls else ""
                 section.set_position(latitude=state["center"][0], longitude=state["center"][1],
-                                     resolution=state["resolution"], zoom=state["zoom"])
+                                     resolution=state["resolution"], zoom=state["zoom"], tile_url=tile_url)
             elif app_type == "images":
                 section.set_url(state["config"]["tileSources"]["url"])
 
@@ -309,10 +326,26 @@ class Section(object):
         url = "%s/instances/%s/state" % (self.get_base_url(), self.section_id)
         self.space.client.post(url, params=data)
 
+        # the mirror is refreshed from REST on the next get_state
+        if self.space.events is not None:
+            self.space.events.invalidate(self.section_id)
+
     def get_state(self):
+        events = self.space.events
+        if events is not None:
+            state = events.get_state(self.section_id)
+            if state is not None:
+                return state
+            events.expect_seed(self.section_id)
+
         url = "%s/instances/%s/state" % (self.get_base_url(), self.section_id)
         r = self.space.client.get(url)
-        return r.json() if r else {}
+        state = r.json() if r else {}
+
+        # later broadcasts for this section are merged into the mirror while the connection stays up
+        if events is not None:
+            events.seed(self.section_id, state if r else None)
+        return state
 
     def get_base_url(self):
         app_names = {'MapSection': 'maps', 'ImageSection': 'images', 'HTMLSection': 'html', 'VideoSection': 'videos',
@@ -551,7 +584,7 @@ class MapSection(Section):
         super(MapSection, self).__init__(section_id, section_data, space)
         self.state = {}
 
-    def set_position(self, name="", latitude=0, longitude=0, resolution=5000, zoom=5):
+    def set_position(self, name="", latitude=0, longitude=0, resolution=5000, zoom=5, tile_url=""):
         # Note the maps app uses coordinates in Web Mercator projection (EPSG:900913)
 
         self.state = {
@@ -559,6 +592,15 @@ class MapSection(Section):
             "resolution": str(resolution),
             "zoom": str(zoom)
         }
+
+        # tile_url is an XYZ template, such as the one returned by Server.enable_tile_proxy()
+        if tile_url:
+            self.state["layers"] = [{
+                "type": "ol.layer.Tile",
+                "visible": True,
+                "source": {"type": "ol.source.XYZ", "config": {"url": tile_url, "crossOrigin": "anonymous"}}
+            }]
+            self.state["enabledLayers"] = ["0"]
         self.set_state(self.state)
 
         request_url = "%s/control.html?oveSectionId=%s" % (self.get_base_url(), self.section_id)
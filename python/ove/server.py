@@ -2,11 +2,37 @@ import http.server
 import socketserver
 import _thread
 import uuid
+import hashlib
+import gzip
+import datetime
+import email.utils
+import multiprocessing
 import matplotlib
+import matplotlib.figure
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
 from shutil import copyfile
 import os
 import socket
 
+from ove.tiles import TileCache, serve_tile
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMAGE_FORMATS = {"jpeg": ".jpg", "webp": ".webp", "png": ".png"}
+
+COMPRESSIBLE_EXTENSIONS = [".json", ".svg", ".gexf", ".csv", ".tsv", ".txt", ".xml", ".html", ".htm", ".js", ".css"]
+
+# preferred encoding first, used to break ties between equal q-values
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
 
 class Server:
     def __init__(self, server_address="", ove_address="localhost:9080", ove_environment="", tmp_dir="./tmp"):
@@ -32,6 +58,11 @@ class Server:
         self.server = False
         self.old_cwd = os.getcwd()
 
+        self.hashes = {}
+        self.tile_cache = None
+        self.pool = None
+        self.pool_workers = None
+
     def __start_server__(self):
         os.chdir(self.tmp_dir)
         self.server.serve_forever()
@@ -41,10 +72,14 @@ class Server:
         (host, ip) = self.server_address.split(':')
         address = (host, int(ip))
 
-        self.server = socketserver.TCPServer(address, http.server.SimpleHTTPRequestHandler)
+        self.server = socketserver.ThreadingTCPServer(address, RequestHandler)
+        self.server.daemon_threads = True
+        self.server.tile_cache = self.tile_cache
         _thread.start_new_thread(self.__start_server__, ())
 
     def stop_server(self, delete_files=False):
+        self.shutdown_pool()
+
         if not self.server:
             return
 
@@ -54,22 +89,132 @@ class Server:
         if delete_files:
             print("Deleting contents of temporary directory", os.getcwd())
             for f in os.listdir(os.getcwd()):
-                os.remove(f)
+                if os.path.isfile(f):
+                    os.remove(f)
 
         os.chdir(self.old_cwd)
 
-    def share_image(self, image):
-        uid = str(uuid.uuid1())
+    def enable_tile_proxy(self, upstream="https://tile.openstreetmap.org/{z}/{x}/{y}.png", cache_dir="./tile_cache",
+                          max_bytes=512 * 1024 * 1024):
+        # relative paths are resolved against the directory the server was created in, as the running server
+        # changes the working directory to tmp_dir, whose contents are served and may be deleted by stop_server
+        cache_dir = os.path.abspath(os.path.join(self.old_cwd, cache_dir))
+        if os.path.commonpath([cache_dir, os.path.abspath(self.tmp_dir)]) == os.path.abspath(self.tmp_dir):
+            raise ValueError("The tile cache directory must be outside %s" % self.tmp_dir)
 
-        if os.path.exists(image):
+        self.tile_cache = TileCache(upstream=upstream, cache_dir=cache_dir, max_bytes=max_bytes)
+        if self.server:
+            self.server.tile_cache = self.tile_cache
+        return self.tile_url()
+
+    def tile_url(self, ext="png"):
+        return self.build_url("tiles/{z}/{x}/{y}." + ext)
+
+    def share_image(self, image, section=None, width=None, height=None, image_format=None, quality=85):
+        if not os.path.exists(image):
+            print("File %s does not exist" % image)
+            return ""
+
+        if section is not None:
+            width, height = section.section_data["w"], section.section_data["h"]
+
+        if not width and not height and not image_format:
+            uid = str(uuid.uuid1())
             ext = os.path.splitext(os.path.basename(image))[-1]
             new_file_name = uid + ext
             copyfile(image, os.path.join(self.tmp_dir, new_file_name))
             return self.build_url(new_file_name)
-        else:
-            print("File %s does not exist" % image)
+
+        if Image is None:
+            print("Pillow is required to resize images, so %s was shared at its original size" % image)
+            return self.share_image(image)
+
+        if image_format is not None:
+            image_format = image_format.lower()
+            if image_format not in IMAGE_FORMATS:
+                print("%s is not a supported image format (%s are supported)" %
+                      (image_format, ", ".join(IMAGE_FORMATS)))
+                return ""
+
+        with Image.open(image) as source:
+            has_alpha = source.mode in ("RGBA", "LA", "PA") or "transparency" in source.info
+
+            # orientations 5 to 8 are rotated by 90 degrees, so the displayed size is transposed
+            displayed = source.size if source.getexif().get(0x0112, 1) < 5 else source.size[::-1]
+            target = (width or displayed[0], height or displayed[1])
+
+            if image_format is None:
+                # images that already fit are shared untouched, rather than re-encoded for nothing
+                if displayed[0] <= target[0] and displayed[1] <= target[1]:
+                    return self.share_image(image)
+
+                # otherwise keep the source format, which stays lossless for PNG and keeps any transparency
+                source_format = (source.format or "").lower()
+                if source_format in IMAGE_FORMATS:
+                    image_format = source_format
+                else:
+                    image_format = "png" if has_alpha else "jpeg"
+
+            # variants are named after the source content and the requested size, so repeated shares reuse the file
+            key = "%s-%sx%s-%s-%s" % (self.hash_file(image), width or 0, height or 0, image_format, quality)
+            new_file_name = hashlib.sha1(key.encode("utf-8")).hexdigest() + IMAGE_FORMATS[image_format]
+            path = os.path.join(self.tmp_dir, new_file_name)
+
+            if not os.path.exists(path):
+                # let the JPEG decoder downscale by a power of two while decoding, keeping at least the requested
+                # size in either orientation, so large photos are not fully decoded just to be shrunk
+                side = max(target)
+                source.draft(source.mode, (side, side))
+
+                # re-encoding drops EXIF, so the orientation tag is applied to the pixels instead
+                img = ImageOps.exif_transpose(source)
+                if image_format == "jpeg" and img.mode not in ("RGB", "L"):
+                    if has_alpha:
+                        # JPEG has no alpha channel, so transparent areas are composited onto white
+                        img = img.convert("RGBA")
+                        background = Image.new("RGB", img.size, (255, 255, 255))
+                        background.paste(img, mask=img.getchannel("A"))
+                        img = background
+                    else:
+                        img = img.convert("RGB")
+                # thumbnail preserves the aspect ratio and never upscales
+                img.thumbnail(target, Image.LANCZOS)
+
+                tmp_path = path + ".part"
+                img.save(tmp_path, format=image_format.upper(), quality=quality)
+                os.replace(tmp_path, path)
+
+        return self.build_url(new_file_name)
+
+    def hash_file(self, file_name):
+        stat = os.stat(file_name)
+        key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime)
+
+        if key not in self.hashes:
+            sha = hashlib.sha1()
+            with open(file_name, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(chunk)
+            self.hashes[key] = sha.hexdigest()
+
+        return self.hashes[key]
+
+    def share_file(self, file_name, compress=True):
+        if not os.path.exists(file_name):
+            print("File %s does not exist" % file_name)
             return ""
 
+        uid = str(uuid.uuid1())
+        ext = os.path.splitext(os.path.basename(file_name))[-1]
+        new_file_name = uid + ext
+        path = os.path.join(self.tmp_dir, new_file_name)
+        copyfile(file_name, path)
+
+        if compress and ext.lower() in COMPRESSIBLE_EXTENSIONS:
+            precompress(path)
+
+        return self.build_url(new_file_name)
+
     def share_matplotlib(self, plot):
         uid = str(uuid.uuid1())
 
@@ -81,6 +226,51 @@ class Server:
             print("Expected a matplotlib.figure.Figure, but received a %s (%s)" % (type(plot), plot))
             return ""
 
+    def share_matplotlib_batch(self, plots, max_workers=None):
+        # plots are figures or callables returning a figure, rendered in worker processes with Agg; workers are
+        # started with forkserver or spawn, so callables must be importable (module-level functions or partials of
+        # them, not lambdas or functions defined interactively); returns one future per plot, in order, which
+        # resolves to the url of the rendered image
+        if self.pool is not None and max_workers is not None and max_workers != self.pool_workers:
+            self.shutdown_pool()
+        if self.pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self.pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=use_agg_backend)
+            self.pool_workers = max_workers
+
+        futures = []
+        for plot in plots:
+            if isinstance(plot, matplotlib.figure.Figure) or callable(plot):
+                file_name = str(uuid.uuid1()) + '.png'
+                futures.append(self.pool.submit(render_figure, plot, os.path.join(self.tmp_dir, file_name),
+                                                self.build_url(file_name)))
+            else:
+                print("Expected a matplotlib.figure.Figure or callable, but received a %s (%s)" % (type(plot), plot))
+                future = Future()
+                future.set_result("")
+                futures.append(future)
+        return futures
+
+    def shutdown_pool(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            self.pool_workers = None
+
+    def iter_share_matplotlib(self, plots, max_workers=None):
+        # yields (index, url) pairs as soon as each plot has been rendered
+        futures = self.share_matplotlib_batch(plots, max_workers=max_workers)
+        indices = {future: i for i, future in enumerate(futures)}
+        for future in as_completed(futures):
+            # a plot that fails to render is reported like an invalid one, so the others still reach the wall
+            try:
+                url = future.result()
+            except Exception as e:
+                print("Could not render plot %s: %s" % (indices[future], e))
+                url = ""
+            yield indices[future], url
+
     def build_url(self, uid):
         if not self.server_address.startswith("http"):
             return "http://%s/%s" % (self.server_address, uid)
@@ -88,6 +278,135 @@ class Server:
             return "%s/%s" % (self.server_address, uid)
 
 
+class RequestHandler(http.server.SimpleHTTPRequestHandler):
+    def do_GET(self):
+        if not self.serve_special():
+            super(RequestHandler, self).do_GET()
+
+    def do_HEAD(self):
+        if not self.serve_special():
+            super(RequestHandler, self).do_HEAD()
+
+    def serve_special(self):
+        self.has_variants = False
+        if self.server.tile_cache is not None and serve_tile(self, self.server.tile_cache):
+            return True
+        return self.serve_precompressed()
+
+    def serve_precompressed(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return False
+
+        variants = [(encoding, path + ext) for encoding, ext in ENCODINGS if os.path.isfile(path + ext)]
+        if not variants:
+            return False
+        self.has_variants = True
+
+        accepted = accepted_encodings(self.headers.get("Accept-Encoding", ""))
+        wildcard = accepted.get("*", 0.0)
+
+        # the variant with the highest q-value wins, ties going to the preferred encoding; "*" covers encodings that
+        # are not listed, and identity is acceptable unless excluded, but only wins with a strictly higher q-value
+        best = None
+        best_quality = 0.0
+        for encoding, variant in variants:
+            quality = accepted.get(encoding, wildcard)
+            if quality > best_quality:
+                best, best_quality = (encoding, variant), quality
+
+        identity = accepted.get("identity", wildcard if "*" in accepted else 1.0)
+        if best is None or identity > best_quality:
+            # the uncompressed file is served by SimpleHTTPRequestHandler, with a Vary header added by end_headers
+            return False
+        encoding, variant = best
+
+        # validators come from the source file, so they agree with the uncompressed response
+        mtime = os.stat(path).st_mtime
+        if self.not_modified_since(mtime):
+            self.send_response(304)
+            self.end_headers()
+            return True
+
+        with open(variant, "rb") as f:
+            self.send_response(200)
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(os.fstat(f.fileno()).st_size))
+            self.send_header("Last-Modified", self.date_time_string(mtime))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.copyfile(f, self.wfile)
+        return True
+
+    def not_modified_since(self, mtime):
+        # the same conditional request check as SimpleHTTPRequestHandler.send_head
+        if "If-Modified-Since" not in self.headers or "If-None-Match" in self.headers:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(self.headers["If-Modified-Since"])
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=datetime.timezone.utc)
+        if since.tzinfo is not datetime.timezone.utc:
+            return False
+
+        last_modified = datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc).replace(microsecond=0)
+        return last_modified <= since
+
+    def end_headers(self):
+        if getattr(self, "has_variants", False):
+            self.send_header("Vary", "Accept-Encoding")
+        super(RequestHandler, self).end_headers()
+
+
+def use_agg_backend():
+    matplotlib.use("Agg")
+
+
+def render_figure(plot, path, url):
+    import matplotlib.pyplot as plt
+
+    figure = plot if isinstance(plot, matplotlib.figure.Figure) else plot()
+    figure.savefig(path, bbox_inches='tight')
+    plt.close(figure)
+    return url
+
+
+def accepted_encodings(header):
+    # maps each listed encoding to its q-value
+    accepted = {}
+    for item in header.split(","):
+        parts = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if parts[0]:
+            accepted[parts[0].lower()] = quality
+    return accepted
+
+
+def precompress(path):
+    with open(path, "rb") as f:
+        data = f.read()
+
+    compressed = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed[".br"] = brotli.compress(data, quality=11)
+
+    for ext, payload in compressed.items():
+        # variants that do not save space are not worth the negotiation
+        if len(payload) < len(data):
+            with open(path + ext, "wb") as f:
+                f.write(payload)
+
+
 def get_ip_address():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     s.connect(("8.8.8.8", 80))
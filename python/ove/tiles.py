@@ -0,0 +1,173 @@
+import os
+import re
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from typing import Tuple
+
+# the extension only makes the url look like an image to browsers: tiles are cached and typed by upstream's response
+TILE_PATH = re.compile(r"^/tiles/(\d+)/(\d+)/(\d+)(\.\w+)?$")
+
+# cached tiles are stored as "z-x-y.<content type>", with the "/" of the content type replaced by "_"
+TILE_FILE = re.compile(r"^(\d+-\d+-\d+)\.[\w.+-]+_[\w.+-]+?(\.part)?$")
+
+
+class TileCache:
+    def __init__(self, upstream="https://tile.openstreetmap.org/{z}/{x}/{y}.png", cache_dir="./tile_cache",
+                 max_bytes=512 * 1024 * 1024, timeout=30, user_agent="ove-sdk tile proxy"):
+        # type: (str, str, int, int, str) -> None
+        self.upstream = upstream
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.user_agent = user_agent
+
+        if cache_dir.startswith('./'):
+            cache_dir = os.path.join(os.getcwd(), cache_dir)
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        # maps "z-x-y" to (file name, size)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        # tiles left over from a previous run are kept, least recently used first, and interrupted writes are
+        # removed; any other file in the directory is left alone and does not count towards max_bytes
+        tiles = []
+        for file_name in os.listdir(cache_dir):
+            match = TILE_FILE.match(file_name)
+            path = os.path.join(cache_dir, file_name)
+            if not match or not os.path.isfile(path):
+                continue
+            if match.group(2):
+                os.remove(path)
+            else:
+                tiles.append((os.path.getatime(path), match.group(1), file_name, os.path.getsize(path)))
+
+        for _, key, file_name, size in sorted(tiles):
+            self.entries[key] = (file_name, size)
+            self.size += size
+        self.evict()
+
+    def get(self, z, x, y):
+        # type: (int, int, int) -> Tuple[bytes, str]
+        key = "%s-%s-%s" % (z, x, y)
+
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                else:
+                    # concurrent misses for the same tile wait for a single upstream fetch
+                    pending = self.in_flight.get(key)
+                    owner = pending is None
+                    if owner:
+                        pending = {"done": threading.Event(), "data": None, "error": None}
+                        self.in_flight[key] = pending
+                        self.misses += 1
+
+            if entry is None:
+                break
+
+            # hits are read outside the lock so they do not queue behind each other's disk reads
+            file_name = entry[0]
+            try:
+                with open(os.path.join(self.cache_dir, file_name), "rb") as f:
+                    return f.read(), file_name.split(".", 1)[1].replace("_", "/", 1)
+            except OSError:
+                # the file was evicted or removed since the lookup, so forget it and fetch the tile again
+                with self.lock:
+                    if self.entries.get(key) == entry:
+                        del self.entries[key]
+                        self.size -= entry[1]
+
+        if not owner:
+            pending["done"].wait()
+            if pending["error"] is not None:
+                raise pending["error"]
+            return pending["data"]
+
+        try:
+            data, content_type = self.fetch(z, x, y)
+            self.store(key, data, content_type)
+            pending["data"] = (data, content_type)
+            return data, content_type
+        except Exception as e:
+            pending["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            pending["done"].set()
+
+    def fetch(self, z, x, y):
+        url = self.upstream.format(z=z, x=x, y=y)
+        request = urllib.request.Request(url, headers={"User-Agent": self.user_agent})
+        with urllib.request.urlopen(request, timeout=self.timeout) as r:
+            content_type = r.headers.get("Content-Type", "application/octet-stream").split(";")[0].strip()
+            return r.read(), content_type
+
+    def store(self, key, data, content_type):
+        file_name = "%s.%s" % (key, content_type.replace("/", "_"))
+        path = os.path.join(self.cache_dir, file_name)
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+                if old[0] != file_name:
+                    try:
+                        os.remove(os.path.join(self.cache_dir, old[0]))
+                    except OSError:
+                        pass
+            self.entries[key] = (file_name, len(data))
+            self.size += len(data)
+            self.evict()
+
+    def evict(self):
+        while self.size > self.max_bytes and self.entries:
+            key, (file_name, size) = self.entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                pass
+
+
+def serve_tile(handler, tile_cache):
+    # returns False if the request is not for a tile, so the handler can fall back to serving files
+    match = TILE_PATH.match(handler.path.split("?")[0])
+    if not match:
+        return False
+
+    z, x, y = match.group(1), match.group(2), match.group(3)
+    try:
+        data, content_type = tile_cache.get(int(z), int(x), int(y))
+    except urllib.error.HTTPError as e:
+        handler.send_error(e.code)
+        return True
+    except (urllib.error.URLError, OSError) as e:
+        print("Tile request failed:", e)
+        handler.send_error(502)
+        return True
+
+    handler.send_response(200)
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Content-Length", str(len(data)))
+    handler.send_header("Cache-Control", "public, max-age=86400")
+    handler.send_header("Access-Control-Allow-Origin", "*")
+    handler.end_headers()
+    if handler.command != "HEAD":
+        handler.wfile.write(data)
+    return True
@@ -0,0 +1,96 @@
+import http.server
+import socketserver
+import threading
+
+import pytest
+
+from ove.cues import CueScheduler, Scene
+from ove.ove import Space
+
+GEOMETRY = {"width": 1000, "height": 1000, "screen_cols": 1, "screen_rows": 1}
+
+
+def image(url="local.png"):
+    return {"w": 100, "h": 100, "x": 0, "y": 0, "app_type": "images", "url": url}
+
+
+@pytest.fixture
+def space():
+    return Space(ove_host="127.0.0.1", space_name="Test", geometry=GEOMETRY)
+
+
+class RangeOrigin(http.server.BaseHTTPRequestHandler):
+    ranges = []
+
+    def do_GET(self):
+        RangeOrigin.ranges.append((self.path, self.headers.get("Range")))
+        self.send_response(206)
+        self.send_header("Content-Length", "4")
+        self.end_headers()
+        self.wfile.write(b"data")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    RangeOrigin.ranges = []
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RangeOrigin)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%s" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_cues_fire_on_time_and_report_jitter(space):
+    scenes = [Scene(0.3, [image()], name="second"), Scene(0.1, [image(), image()], name="first")]
+    scheduler = CueScheduler(space, scenes)
+    report = scheduler.run()
+
+    assert [entry["scene"] for entry in report] == ["first", "second"]
+    for entry in report:
+        assert abs(entry["jitter"]) < 0.05
+        assert entry["fired"] <= entry["completed"]
+
+    # the second scene cleared the first one's sections
+    assert len(space.sections) == 1
+    assert space.sections[0].state["config"]["tileSources"]["url"] == "local.png"
+
+    summary = scheduler.summary()
+    assert summary["cues"] == 2
+    assert summary["max_jitter"] == max(abs(entry["jitter"]) for entry in report)
+
+
+def test_stop_ends_the_show(space):
+    scheduler = CueScheduler(space, [Scene(0.05, [image()], name="first"), Scene(30, [image()], name="later")])
+    thread = scheduler.start()
+
+    assert not scheduler.stopped.wait(0.3)
+    scheduler.stop()
+    thread.join(2)
+
+    assert not thread.is_alive()
+    assert [entry["scene"] for entry in scheduler.report] == ["first"]
+
+
+def test_prepare_leaves_scenes_untouched(space):
+    spec = image()
+    scene = Scene(0, [spec])
+    CueScheduler(space, [scene]).prepare()
+
+    assert spec == image()
+    assert scene.sections[0] is spec
+
+
+def test_urls_in_method_arguments_are_warmed(space, origin, capsys):
+    network = {"w": 100, "h": 100, "x": 0, "y": 0, "app_type": "networks", "method": "set_data",
+               "kwargs": {"json_url": origin + "/graph.json"}}
+    scheduler = CueScheduler(space, [Scene(0.2, [network, image(origin + "/photo.png"), image("http://")])])
+    scheduler.run()
+
+    # warming only asks for the head of each asset, and a bad url is reported without stopping the show
+    assert sorted(RangeOrigin.ranges) == [("/graph.json", "bytes=0-1048575"), ("/photo.png", "bytes=0-1048575")]
+    assert "Prefetch of http:// failed" in capsys.readouterr().out
+    assert space.sections[0].state["jsonURL"] == origin + "/graph.json"
@@ -0,0 +1,236 @@
+import asyncio
+import base64
+import hashlib
+import http.server
+import json
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("websocket")
+
+from ove.events import EventBus
+from ove.ove import MapSection, Space
+
+GEOMETRY = {"width": 1000, "height": 1000, "screen_cols": 1, "screen_rows": 1}
+
+
+class WebSocketStandIn:
+    # a minimal websocket server that accepts one client and sends it text frames on request
+
+    def __init__(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.client = None
+        self.accepted = threading.Event()
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        client, _ = self.listener.accept()
+        request = b""
+        while b"\r\n\r\n" not in request:
+            request += client.recv(4096)
+
+        key = [line.split(b":", 1)[1].strip() for line in request.split(b"\r\n")
+               if line.lower().startswith(b"sec-websocket-key")][0]
+        accept = base64.b64encode(hashlib.sha1(key + b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11").digest())
+        client.sendall(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                       b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        self.client = client
+        self.accepted.set()
+
+    def send(self, data):
+        payload = json.dumps(data).encode("utf-8")
+        header = bytes([0x81, len(payload)]) if len(payload) < 126 else \
+            bytes([0x81, 126]) + len(payload).to_bytes(2, "big")
+        self.client.sendall(header + payload)
+
+    def disconnect(self):
+        self.client.sendall(bytes([0x88, 0]))
+        self.client.close()
+        self.listener.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class RestStandIn(http.server.BaseHTTPRequestHandler):
+    # serves the state of section 1 of the maps app, running on_get while a GET is in flight
+
+    state = {}
+    gets = 0
+    on_get = None
+
+    def do_GET(self):
+        RestStandIn.gets += 1
+        if RestStandIn.on_get is not None:
+            RestStandIn.on_get()
+        self.reply(RestStandIn.state)
+
+    def do_POST(self):
+        RestStandIn.state = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.reply({})
+
+    def reply(self, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def section(origin):
+    RestStandIn.state = {"zoom": 5}
+    RestStandIn.gets = 0
+    RestStandIn.on_get = None
+    rest = socketserver.ThreadingTCPServer(("127.0.0.1", 0), RestStandIn)
+    rest.daemon_threads = True
+    threading.Thread(target=rest.serve_forever, daemon=True).start()
+
+    space = Space(ove_host="127.0.0.1", space_name="Test", control_port=rest.server_address[1], geometry=GEOMETRY)
+    space.enable_online_mode()
+    space.events = EventBus(space)
+    space.events.ws_url = "ws://127.0.0.1:%s/" % origin.port
+    space.events.start()
+    assert space.events.wait_until_connected(5)
+    assert origin.accepted.wait(5)
+
+    yield MapSection("1", {"w": 10, "h": 10, "x": 0, "y": 0}, space)
+
+    space.unsubscribe()
+    rest.shutdown()
+    rest.server_close()
+
+
+@pytest.fixture
+def origin():
+    stand_in = WebSocketStandIn()
+    yield stand_in
+    stand_in.listener.close()
+
+
+def test_state_changes_are_mirrored_until_disconnect(origin):
+    space = Space(ove_host="127.0.0.1", space_name="Test", control_port=origin.port, geometry=GEOMETRY)
+    events = space.subscribe(reconnect_delay=60)
+    assert events.wait_until_connected(5)
+    assert origin.accepted.wait(5)
+
+    received = []
+    events.on_state_change(received.append)
+    playback = []
+    events.on_playback(playback.append)
+
+    # broadcasts for sections that have not been seeded are reported but not mirrored
+    origin.send({"appId": "maps", "sectionId": 2, "message": {"zoom": 3}})
+    assert wait_for(lambda: len(received) == 1)
+    assert events.get_state("2") is None
+
+    events.expect_seed("1")
+    events.seed("1", {"center": [0, 0], "zoom": 5})
+    origin.send({"appId": "maps", "sectionId": 1, "message": {"zoom": 7}})
+    origin.send({"appId": "videos", "sectionId": 1, "message": {"operation": {"name": "play"}}})
+    assert wait_for(lambda: len(playback) == 1)
+
+    assert received[-1] == {"type": "state", "app": "maps", "section_id": "1", "data": {"zoom": 7}}
+    assert events.get_state(1) == {"center": [0, 0], "zoom": 7}
+    assert playback[0]["data"] == {"name": "play"}
+
+    origin.disconnect()
+    assert wait_for(lambda: not events.connected.is_set())
+    assert events.get_state(1) is None
+    assert events.states == {}
+
+    space.unsubscribe()
+
+
+def test_stop_does_not_block_on_a_full_queue(origin):
+    space = Space(ove_host="127.0.0.1", space_name="Test", control_port=origin.port, geometry=GEOMETRY)
+    events = space.subscribe()
+    events.max_queue_size = 2
+
+    iterator = events.events(timeout=5)
+    threading.Timer(0.1, events.dispatch, [{"appId": "maps", "sectionId": 0, "message": {}}]).start()
+    assert next(iterator)["section_id"] == "0"
+
+    for i in range(1, 5):
+        events.dispatch({"appId": "maps", "sectionId": i, "message": {}})
+
+    stopper = threading.Thread(target=space.unsubscribe)
+    stopper.start()
+    stopper.join(2)
+    assert not stopper.is_alive()
+
+    # the oldest events were dropped to make room for the end-of-stream marker
+    assert [event["section_id"] for event in iterator] == ["4"]
+
+
+def test_async_events_can_be_cancelled(origin):
+    space = Space(ove_host="127.0.0.1", space_name="Test", control_port=origin.port, geometry=GEOMETRY)
+    events = space.subscribe()
+    received = []
+
+    async def main():
+        iterator = events.async_events()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(iterator.__anext__(), 0.1)
+
+        iterator = events.async_events()
+        threading.Timer(0.1, events.dispatch, [{"appId": "maps", "sectionId": 3, "message": {"zoom": 1}}]).start()
+        received.append(await asyncio.wait_for(iterator.__anext__(), 5))
+        await iterator.aclose()
+
+    runner = threading.Thread(target=asyncio.run, args=(main(),))
+    runner.start()
+    runner.join(5)
+    assert not runner.is_alive()
+
+    assert received[0]["section_id"] == "3"
+    assert events.subscribers == []
+    space.unsubscribe()
+
+
+def test_broadcast_during_rest_fetch_prevents_seeding(origin, section):
+    received = []
+    section.space.events.on_state_change(received.append)
+
+    def broadcast():
+        origin.send({"appId": "maps", "sectionId": 1, "message": {"zoom": 6}})
+        assert wait_for(lambda: len(received) == 1)
+
+    RestStandIn.on_get = broadcast
+    assert section.get_state() == {"zoom": 5}
+    # the fetched state may predate the broadcast, so it is not mirrored and the next call asks again
+    assert section.space.events.get_state("1") is None
+
+    RestStandIn.on_get = None
+    RestStandIn.state = {"zoom": 6}
+    assert section.get_state() == {"zoom": 6}
+    assert section.get_state() == {"zoom": 6}
+    assert RestStandIn.gets == 2
+
+
+def test_set_state_drops_the_mirrored_state(origin, section):
+    assert section.get_state() == {"zoom": 5}
+    assert section.get_state() == {"zoom": 5}
+    assert RestStandIn.gets == 1
+
+    section.set_state({"zoom": 9})
+    assert section.space.events.get_state("1") is None
+    assert section.get_state() == {"zoom": 9}
+    assert RestStandIn.gets == 2
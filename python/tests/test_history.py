@@ -0,0 +1,81 @@
+import json
+import os
+
+from ove.history import LayoutHistory
+
+
+def section(x, url, y=0):
+    return {"space": "OVE_SPACE", "x": x, "y": y, "w": 100, "h": 100,
+            "app": {"url": "OVE_APP_HTML", "states": {"load": {"url": url}}}}
+
+
+def layout(*sections, **attribution):
+    return json.dumps({"Attribution": attribution or {"Title": "Show"}, "Sections": list(sections)})
+
+
+def count_objects(history):
+    return sum(len(files) for _, _, files in os.walk(history.objects_dir))
+
+
+def test_checkout_restores_each_version(tmp_path):
+    history = LayoutHistory(str(tmp_path / "history"))
+    first = layout(section(0, "a"), section(100, "b"))
+    second = layout(section(0, "a"), section(100, "c"))
+
+    assert history.commit(first) == 0
+    assert history.commit(second, message="changed b") == 1
+
+    # a fresh store reads everything back from disk
+    reopened = LayoutHistory(str(tmp_path / "history"))
+    assert json.loads(reopened.checkout(0)) == json.loads(first)
+    assert json.loads(reopened.checkout()) == json.loads(second)
+    assert [v["message"] for v in reopened.versions()] == ["", "changed b"]
+
+
+def test_unchanged_layouts_and_sections_are_stored_once(tmp_path):
+    history = LayoutHistory(str(tmp_path / "history"))
+
+    assert history.commit(layout(section(0, "a"), section(100, "b"))) == 0
+    assert history.commit(layout(section(0, "a"), section(100, "b"))) == 0
+    assert history.commit(layout(section(0, "a"), section(100, "b"), Title="Renamed")) == 1
+    assert history.commit(layout(section(0, "a"), section(100, "c"), Title="Renamed")) == 2
+
+    assert len(history.versions()) == 3
+    assert count_objects(history) == 3
+
+
+def test_diff_pairs_changed_sections_and_reports_order(tmp_path):
+    history = LayoutHistory(str(tmp_path / "history"))
+    v0 = history.commit(layout(section(0, "a"), section(100, "b"), section(200, "c")))
+    v1 = history.commit(layout(section(200, "c"), section(0, "a"), section(100, "changed"), section(0, "d", y=100)))
+
+    diff = history.diff(v0, v1)
+    assert diff["unchanged"] == 2
+    assert diff["reordered"]
+    assert diff["changed"] == [{"old_index": 1, "new_index": 2,
+                                "old": section(100, "b"), "new": section(100, "changed")}]
+    assert diff["added"] == [section(0, "d", y=100)]
+    assert diff["removed"] == []
+
+    v2 = history.commit(layout(section(200, "c"), section(0, "a"), section(100, "changed")))
+    assert history.diff(v1, v2) == {"added": [], "removed": [section(0, "d", y=100)], "changed": [],
+                                    "unchanged": 3, "reordered": False}
+
+
+def test_reordering_alone_is_reported(tmp_path):
+    history = LayoutHistory(str(tmp_path / "history"))
+    v0 = history.commit(layout(section(0, "a"), section(100, "b")))
+    v1 = history.commit(layout(section(100, "b"), section(0, "a")))
+
+    diff = history.diff(v0, v1)
+    assert (diff["added"], diff["removed"], diff["changed"]) == ([], [], [])
+    assert diff["reordered"]
+
+
+def test_diff_results_can_be_modified(tmp_path):
+    history = LayoutHistory(str(tmp_path / "history"))
+    v0 = history.commit(layout(section(0, "a")))
+    v1 = history.commit(layout(section(0, "a"), section(100, "b")))
+
+    history.diff(v0, v1)["added"][0]["x"] = 999
+    assert json.loads(history.checkout(v1))["Sections"][1] == section(100, "b")
@@ -0,0 +1,162 @@
+import gzip
+import json
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip("matplotlib")
+Image = pytest.importorskip("PIL.Image")
+
+from ove.server import Server
+
+
+class Section:
+    def __init__(self, w, h):
+        self.section_data = {"w": w, "h": h, "x": 0, "y": 0}
+
+
+@pytest.fixture
+def server(tmp_path):
+    return Server(server_address="127.0.0.1:8000", tmp_dir=str(tmp_path / "tmp"))
+
+
+def shared(server, url):
+    return os.path.join(server.tmp_dir, url.rsplit("/", 1)[-1])
+
+
+def test_images_are_resized_to_the_section(server, tmp_path):
+    source = str(tmp_path / "photo.jpg")
+    Image.new("RGB", (4000, 3000), (0, 128, 255)).save(source)
+
+    url = server.share_image(source, section=Section(400, 400))
+    assert url.endswith(".jpg")
+    with Image.open(shared(server, url)) as img:
+        assert img.size == (400, 300)
+
+    # the variant is reused rather than encoded again
+    assert server.share_image(source, section=Section(400, 400)) == url
+    assert len(os.listdir(server.tmp_dir)) == 1
+
+    webp = server.share_image(source, width=200, image_format="webp")
+    with Image.open(shared(server, webp)) as img:
+        assert (img.format, img.size) == ("WEBP", (200, 150))
+
+
+def test_exif_orientation_is_applied(server, tmp_path):
+    source = str(tmp_path / "camera.jpg")
+    img = Image.new("RGB", (4000, 3000))
+    exif = img.getexif()
+    exif[0x0112] = 6
+    img.save(source, exif=exif)
+
+    with Image.open(shared(server, server.share_image(source, width=300, height=400))) as img:
+        assert img.size == (300, 400)
+
+
+def test_transparency_is_kept_unless_jpeg_is_requested(server, tmp_path):
+    source = str(tmp_path / "overlay.png")
+    Image.new("RGBA", (4000, 3000), (255, 0, 0, 0)).save(source)
+
+    with Image.open(shared(server, server.share_image(source, section=Section(400, 400)))) as img:
+        assert img.format == "PNG"
+        assert img.getpixel((0, 0))[3] == 0
+
+    with Image.open(shared(server, server.share_image(source, section=Section(400, 400), image_format="jpeg"))) as img:
+        assert img.format == "JPEG"
+        assert all(channel > 250 for channel in img.getpixel((0, 0)))
+
+
+def test_images_that_fit_are_shared_untouched(server, tmp_path):
+    source = str(tmp_path / "screenshot.png")
+    Image.new("RGB", (300, 200), (10, 20, 30)).save(source)
+
+    url = server.share_image(source, section=Section(400, 400))
+    with open(source, "rb") as original, open(shared(server, url), "rb") as copy:
+        assert original.read() == copy.read()
+
+
+@pytest.fixture
+def running_server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    server = Server(server_address="127.0.0.1:0", tmp_dir=str(tmp_path / "tmp"))
+    server.start_server()
+    server.server_address = "127.0.0.1:%s" % server.server.server_address[1]
+    yield server
+    server.stop_server()
+
+
+def fetch(url, **headers):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as r:
+            return r.status, r.headers, r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, b""
+
+
+def test_shared_text_is_served_precompressed(running_server, tmp_path):
+    source = tmp_path / "graph.json"
+    source.write_text(json.dumps({"nodes": [{"id": i, "label": "node %d" % i} for i in range(1000)]}))
+    url = running_server.share_file(str(source))
+
+    status, headers, body = fetch(url, **{"Accept-Encoding": "gzip, deflate"})
+    assert (status, headers["Content-Encoding"], headers["Vary"]) == (200, "gzip", "Accept-Encoding")
+    assert headers["Content-Type"] == "application/json"
+    assert gzip.decompress(body) == source.read_bytes()
+
+    # the uncompressed fallback also varies on Accept-Encoding
+    status, headers, body = fetch(url, **{"Accept-Encoding": "identity"})
+    assert (status, headers["Content-Encoding"], headers["Vary"]) == (200, None, "Accept-Encoding")
+    assert body == source.read_bytes()
+
+    status, headers, _ = fetch(url, **{"Accept-Encoding": "gzip", "If-Modified-Since": headers["Last-Modified"]})
+    assert (status, headers["Vary"]) == (304, "Accept-Encoding")
+
+
+def test_encodings_are_negotiated_by_q_value(running_server, tmp_path):
+    source = tmp_path / "drawing.svg"
+    source.write_text("<svg>%s</svg>" % ("<g/>" * 1000))
+    url = running_server.share_file(str(source))
+    # a stand-in brotli variant, so negotiation can be tested without the brotli package
+    with open(shared(running_server, url) + ".br", "wb") as f:
+        f.write(b"brotli")
+
+    def encoding(accept):
+        return fetch(url, **{"Accept-Encoding": accept})[1]["Content-Encoding"]
+
+    assert encoding("gzip, br") == "br"
+    assert encoding("br;q=0.1, gzip") == "gzip"
+    assert encoding("*") == "br"
+    assert encoding("br;q=0, *;q=0.5") == "gzip"
+    assert encoding("gzip;q=0.5, identity") is None
+    assert encoding("br;q=0, gzip;q=0") is None
+    assert encoding("") is None
+
+
+def make_plot(points=3):
+    import matplotlib.pyplot as plt
+
+    figure = plt.figure()
+    plt.plot(range(points))
+    return figure
+
+
+def fail_to_plot():
+    raise RuntimeError("no data")
+
+
+def test_batch_rendering_reports_failures_per_plot(server, capsys):
+    try:
+        results = dict(server.iter_share_matplotlib([fail_to_plot, make_plot, 42], max_workers=2))
+    finally:
+        server.shutdown_pool()
+
+    assert results[0] == ""
+    assert results[2] == ""
+    with Image.open(shared(server, results[1])) as img:
+        assert img.format == "PNG"
+
+    out = capsys.readouterr().out
+    assert "Could not render plot 0: no data" in out
+    assert "Expected a matplotlib.figure.Figure or callable" in out
@@ -0,0 +1,124 @@
+import http.server
+import os
+import socketserver
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from ove.tiles import TileCache
+
+
+class CountingOrigin(http.server.BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        CountingOrigin.requests.append(self.path)
+        time.sleep(0.2)
+        body = self.path.encode("utf-8")[:4].ljust(4, b"-")
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def origin():
+    CountingOrigin.requests = []
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), CountingOrigin)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:%s/{z}/{x}/{y}.png" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_misses_trigger_one_fetch(origin, tmp_path):
+    cache = TileCache(upstream=origin, cache_dir=str(tmp_path / "tiles"))
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(1, 2, 3))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert CountingOrigin.requests == ["/1/2/3.png"]
+    assert results == [(b"/1/2", "image/png")] * 8
+    assert cache.get(1, 2, 3) == (b"/1/2", "image/png")
+    assert cache.hits == 1
+    assert len(CountingOrigin.requests) == 1
+
+
+def test_least_recently_used_tiles_are_evicted(origin, tmp_path):
+    cache_dir = tmp_path / "tiles"
+    cache = TileCache(upstream=origin, cache_dir=str(cache_dir), max_bytes=10)
+
+    cache.get(1, 0, 0)
+    cache.get(2, 0, 0)
+    cache.get(1, 0, 0)
+    cache.get(3, 0, 0)
+
+    # tile 2 was used least recently, so it made room for tile 3
+    assert list(cache.entries) == ["1-0-0", "3-0-0"]
+    assert cache.size == 8
+    assert sorted(os.listdir(str(cache_dir))) == ["1-0-0.image_png", "3-0-0.image_png"]
+
+    cache.get(2, 0, 0)
+    assert CountingOrigin.requests.count("/2/0/0.png") == 2
+
+
+def test_missing_cache_files_are_fetched_again(origin, tmp_path):
+    cache_dir = tmp_path / "tiles"
+    cache = TileCache(upstream=origin, cache_dir=str(cache_dir))
+
+    cache.get(1, 0, 0)
+    os.remove(str(cache_dir / "1-0-0.image_png"))
+
+    assert cache.get(1, 0, 0) == (b"/1/0", "image/png")
+    assert len(CountingOrigin.requests) == 2
+
+
+def test_server_proxies_tiles_outside_tmp_dir(origin, tmp_path, monkeypatch):
+    pytest.importorskip("matplotlib")
+    from ove.server import Server
+
+    monkeypatch.chdir(tmp_path)
+    server = Server(server_address="127.0.0.1:0", tmp_dir=str(tmp_path / "tmp"))
+    server.start_server()
+    port = server.server.server_address[1]
+    server.server_address = "127.0.0.1:%s" % port
+
+    try:
+        tile_url = server.enable_tile_proxy(upstream=origin)
+        with urllib.request.urlopen(tile_url.format(z=4, x=5, y=6).replace(".png", ".jpg")) as r:
+            assert r.read() == b"/4/5"
+            assert r.headers["Content-Type"] == "image/png"
+    finally:
+        server.stop_server(delete_files=True)
+
+    assert os.getcwd() == str(tmp_path)
+    assert os.listdir(str(tmp_path / "tile_cache")) == ["4-5-6.image_png"]
+    with pytest.raises(ValueError):
+        server.enable_tile_proxy(upstream=origin, cache_dir=str(tmp_path / "tmp" / "tiles"))
+
+
+def test_only_tile_files_are_adopted_from_an_existing_directory(origin, tmp_path):
+    cache_dir = tmp_path / "tiles"
+    cache_dir.mkdir()
+    (cache_dir / "notes.txt").write_bytes(b"x" * 100)
+    (cache_dir / "upload.part").write_bytes(b"x" * 100)
+    (cache_dir / "1-0-0.image_png").write_bytes(b"tile")
+    (cache_dir / "2-0-0.image_png.part").write_bytes(b"ti")
+
+    cache = TileCache(upstream=origin, cache_dir=str(cache_dir), max_bytes=10)
+
+    assert dict(cache.entries) == {"1-0-0": ("1-0-0.image_png", 4)}
+    assert sorted(os.listdir(str(cache_dir))) == ["1-0-0.image_png", "notes.txt", "upload.part"]
+    assert cache.get(1, 0, 0) == (b"tile", "image/png")
+    assert CountingOrigin.requests == []